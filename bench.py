@@ -0,0 +1,160 @@
+import argparse, asyncio, os, statistics, sys, time
+from launcher import newloop, readout, uvloop
+from logstore import openlog
+from scripts import extprg, install
+import workers
+
+EXTPRG = '/tmp/extprg.py'
+LOADGEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadgen.py')
+
+async def capture(cmd, mode, log, onblock=None):
+    # Reads cmd to the end into log through the loop of the jobs and views; onblock(block, time) is called for each
+    # block appended.
+    def append(block, stream, readat):
+        log.write(block, stream)
+        if onblock: onblock(block, time.time())
+    return await readout(cmd, mode, append)
+
+async def captureall(children, iterations, mode):
+    logs = [openlog() for i in range(children)]
+    await asyncio.gather(*(capture(f'python3 {EXTPRG} Bench{i} {iterations} 0', mode, log) for i, log in enumerate(logs)))
+    return sum(log.end for log in logs)
+
+def loops(children, iterations, mode):
+    # Lines per second read from children concurrent extprg.py commands, with each available event loop.
+    install(EXTPRG, extprg)
+    print(f'{"loop":8} {"children":>8} {"lines":>10} {"seconds":>8} {"lines/s":>10}')
+    for name, fast in [('asyncio', False), ('uvloop', True)]:
+        if fast and not uvloop: continue
+        loop = newloop(fast)
+        start = time.perf_counter()
+        lines = loop.run_until_complete(captureall(children, iterations, mode))
+        elapsed = time.perf_counter() - start
+        loop.close()
+        print(f'{name:8} {children:8} {lines:10} {elapsed:8.2f} {lines / elapsed:10.0f}')
+
+def rss():
+    with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def run(args, mode, store, rate):
+    # One run of loadgen.py captured with mode and store: latencies from the write of each line by the child to the
+    # append of its block to the log, lines per second and memory growth of this process.
+    latencies = []
+    def onblock(block, now):
+        for line in block.splitlines():
+            if line: latencies.append(now - float(line.split(b' ', 1)[0]))
+    cmd = f'{sys.executable} {LOADGEN} --lines {args.lines} --rate {rate} --length {args.length} --stderr {args.stderr} --burst {args.burst} --seed {args.seed}'
+    if args.buffered: cmd += ' --buffered'
+    log = openlog(store, max_lines=args.lines, max_bytes=args.lines * args.length)
+    before = rss()
+    loop = newloop()
+    start = time.perf_counter()
+    loop.run_until_complete(capture(cmd, mode, log, onblock))
+    elapsed = time.perf_counter() - start
+    loop.close()
+    grown = rss() - before
+    log.close()
+    latencies.sort()
+    return len(latencies), elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.99)], grown
+
+def load(args):
+    # For every capture mode and every store: the latency at the requested rate, then the rate reached unthrottled.
+    print(f'{"mode":5} {"store":6} {"lines":>8} {"p50 ms":>8} {"p99 ms":>8} {"max lines/s":>12} {"rss MiB":>8}')
+    for mode in ('pty', 'pipe', 'spawn'):
+        for store in ('ring', 'spool'):
+            lines, elapsed, p50, p99, grown = run(args, mode, store, args.rate)
+            unthrottled = run(args, mode, store, 0)
+            print(f'{mode:5} {store:6} {lines:8} {p50 * 1000:8.2f} {p99 * 1000:8.2f} {unthrottled[0] / unthrottled[1]:12.0f} {grown / (1 << 20):8.1f}')
+
+def reruns(runs):
+    # Mean duration of a rerun of the page, with the compiled blocks cached and with the blocks compiled at each run.
+    # The lazy blocks only run while their section is expanded, so every "Run the example" section is opened through
+    # its session_state key before the timed reruns: each rerun executes all the blocks, up to their forms.
+    from streamlit.testing.v1 import AppTest
+    source = open(os.path.join(os.path.dirname(LOADGEN), 'longrunning.py')).read()
+    variants = [('cached', source), ('compiled', source.replace('compiled_code = compiled(bloc)', 'compiled_code = compile(bloc, "<string>", "exec")'))]
+    print(f'{"blocks":8} {"sections":>8} {"runs":>5} {"ms/rerun":>9}')
+    for name, variant in variants:
+        app = AppTest.from_string(variant, default_timeout=60)
+        app.run()
+        sections = [section.key for section in app.expander if section.key and section.key.startswith('run')]
+        for key in sections: app.session_state[key] = True
+        app.run()
+        if app.exception: sys.exit(app.exception[0].value)
+        start = time.perf_counter()
+        for i in range(runs): app.run()
+        print(f'{name:8} {len(sections):8} {runs:5} {(time.perf_counter() - start) / runs * 1000:9.1f}')
+
+def launches(count, processes):
+    # Python commands started and ended per second by a pool of workers, each start being a new interpreter
+    # (command) or a fork of a pre-warmed one (script). The commands run extprg.py without iterations.
+    install(EXTPRG, extprg)
+    pool = workers.Pool(processes=processes)
+    for i, kind, payload in pool.stream([(workers.script, (EXTPRG, 'Warmup', '0', '0'))] * processes): pass
+    print(f'{"launcher":10} {"commands":>8} {"seconds":>8} {"commands/s":>10}')
+    for name, call in [('command', (workers.command, (f'python3 {EXTPRG} Bench 0 0',))), ('script', (workers.script, (EXTPRG, 'Bench', '0', '0')))]:
+        start = time.perf_counter()
+        for i, kind, payload in pool.stream([call] * count):
+            if kind == 'error': sys.exit(payload)
+        seconds = time.perf_counter() - start
+        print(f'{name:10} {count:8} {seconds:8.2f} {count / seconds:10.0f}')
+    pool.close()
+
+def spawns(count, cmd, ballast):
+    # Commands started and ended per second, one after the other, with pexpect as in the first examples and with
+    # each mode of spawn. ballast MiB of touched memory make this process look like a large server, whose pages a
+    # fork has to map again in the child.
+    import pexpect
+    ballast = b'x' * (ballast << 20)
+    print(f'{"launcher":8} {"commands":>8} {"seconds":>8} {"commands/s":>10}')
+    # pexpect0 is pexpect without the 0.1 s its close sleeps by default before checking the end of the child.
+    for name, delay in [('pexpect', None), ('pexpect0', 0)]:
+        start = time.perf_counter()
+        for i in range(count):
+            child = pexpect.spawn(cmd)
+            if delay is not None: child.ptyproc.delayafterclose = delay
+            child.expect(pexpect.EOF)
+            child.close()
+        seconds = time.perf_counter() - start
+        print(f'{name:8} {count:8} {seconds:8.2f} {count / seconds:10.0f}')
+    for mode in ('pty', 'pipe', 'spawn'):
+        loop = asyncio.new_event_loop()
+        start = time.perf_counter()
+        for i in range(count): loop.run_until_complete(capture(cmd, mode, openlog()))
+        seconds = time.perf_counter() - start
+        loop.close()
+        print(f'{mode:8} {count:8} {seconds:8.2f} {count / seconds:10.0f}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the capture of long-running commands.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('loops', help='lines/s across concurrent extprg.py children under each event loop')
+    command.add_argument('--children', type=int, default=200)
+    command.add_argument('--iterations', type=int, default=2000)
+    command.add_argument('--mode', choices=['pty', 'pipe', 'spawn'], default='pty')
+    command = commands.add_parser('load', help='latency, max lines/s and memory of every capture mode, driven by loadgen.py')
+    command.add_argument('--lines', type=int, default=20000)
+    command.add_argument('--rate', type=float, default=5000, help='lines per second of the latency runs')
+    command.add_argument('--length', type=int, default=80)
+    command.add_argument('--stderr', type=float, default=0.1)
+    command.add_argument('--burst', type=int, default=1)
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--buffered', action='store_true')
+    command = commands.add_parser('reruns', help='duration of a rerun of longrunning.py, every example section open, with and without the cache of compiled blocks')
+    command.add_argument('--runs', type=int, default=20)
+    command = commands.add_parser('launches', help='Python commands/s with new interpreters and with pre-warmed ones')
+    command.add_argument('--count', type=int, default=500)
+    command.add_argument('--processes', type=int, default=4)
+    command = commands.add_parser('spawns', help='commands/s started by pexpect and by each mode of spawn, from a process of a given size')
+    command.add_argument('--count', type=int, default=500)
+    command.add_argument('--cmd', default='true')
+    command.add_argument('--ballast', type=int, default=0, help='MiB of memory held by the benchmark process')
+    args = parser.parse_args()
+    if args.command == 'loops': loops(args.children, args.iterations, args.mode)
+    if args.command == 'load': load(args)
+    if args.command == 'reruns': reruns(args.runs)
+    if args.command == 'launches': launches(args.count, args.processes)
+    if args.command == 'spawns': spawns(args.count, args.cmd, args.ballast)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import asyncio, itertools, threading
+import streamlit as st
+from launcher import eventloop, readout
+from logstore import openlog
+from logview import LogView, pager
+
+class Job:
+    def __init__(self, id, cmd, endst, log):
+        self.id = id
+        self.cmd = cmd
+        self.endst = endst or cmd
+        self.log = log
+        self.lock = threading.Lock()
+        self.state = 'running'
+        self.exitstatus = None
+        self.closed = False
+
+    def window(self, start, count):
+        # The (stream, line) entries of lines start to start + count, or of the last count lines when start is None;
+        # none once the job is pruned.
+        with self.lock:
+            if self.closed: return []
+            if start is None: start = self.log.end - count
+            return self.log.tagged(start, start + count)
+
+    def close(self):
+        # Under the lock: another session may be reading a window of the log.
+        with self.lock:
+            self.log.close()
+            self.closed = True
+
+    def label(self):
+        if self.state == 'running': return self.cmd
+        label = f"{self.endst}: Complete" if self.state == 'complete' else f"{self.endst}: Ended with errors"
+        if self.log.dropped: label += f" ({self.log.dropped} lines dropped)"
+        return label
+
+class JobManager:
+    # Process-wide registry of commands: the jobs are read into their log by coroutines running on a background
+    # event loop, so a Streamlit rerun only re-attaches to the jobs instead of abandoning them. With fast=True, a job
+    # runs on the uvloop event loop when uvloop is installed; all the jobs share the same ids whatever their loop.
+    def __init__(self, keep=100):
+        self.keep = keep
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, cmd, endst=None, mode='pty', store='ring', max_lines=10000, max_bytes=1 << 20, fast=False):
+        with self.lock:
+            job = Job(next(self.ids), cmd, endst, openlog(store, max_lines=max_lines, max_bytes=max_bytes))
+            self.jobs[job.id] = job
+            self.prune()
+        asyncio.run_coroutine_threadsafe(self.run(job, mode), eventloop(fast))
+        return job.id
+
+    async def run(self, job, mode):
+        try:
+            def onblock(block, stream, readat):
+                with job.lock: job.log.write(block, stream)
+            job.exitstatus = await readout(job.cmd, mode, onblock)
+        except Exception as e:
+            with job.lock: job.log.append(f'{e}\n')
+        job.state = 'complete' if job.exitstatus == 0 else 'error'
+
+    def prune(self):
+        done = [id for id, job in self.jobs.items() if job.state != 'running']
+        for id in done[:max(0, len(done) - self.keep)]: self.jobs.pop(id).close()
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+@st.cache_resource
+def jobmanager():
+    return JobManager()
+
+def attach(job, height=300):
+    # Only the window displayed by the view is read from the job log: the last lines when following the job,
+    # or the page chosen by the user.
+    with st.status(job.label(), state=job.state, expanded=job.state == 'running'):
+        start = pager(f'job{job.id}', LogView.rowsfor(height))
+        view = LogView(job.log, height=height, start=start)
+        view.show(job.window(start, view.rows))
@@ -0,0 +1,207 @@
+import asyncio, errno, heapq, itertools, os, pty, shlex, signal, threading, time
+import streamlit as st
+try: import uvloop
+except ImportError: uvloop = None
+from logstore import openlog
+from logview import LogView, pager
+
+class Spawned:
+    # A command started by os.posix_spawn, with what is used here of asyncio.subprocess.Process: its end is watched
+    # by the event loop through a pidfd, without a child watcher thread.
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.pidfd = os.pidfd_open(pid)
+        self.loop = asyncio.get_running_loop()
+        self.ended = self.loop.create_future()
+        self.loop.add_reader(self.pidfd, self.reap)
+
+    def reap(self):
+        self.loop.remove_reader(self.pidfd)
+        self.returncode = os.waitstatus_to_exitcode(os.waitpid(self.pid, 0)[1])
+        os.close(self.pidfd)
+        self.ended.set_result(self.returncode)
+
+    async def wait(self):
+        return await self.ended
+
+    def kill(self):
+        # Through the pidfd: the signal can not reach another process which would have reused the pid.
+        if self.returncode is None: signal.pidfd_send_signal(self.pidfd, signal.SIGKILL)
+
+async def connect(fd):
+    reader = asyncio.StreamReader(limit=1 << 20)
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', 0))
+    return reader
+
+async def spawn(cmd, mode='pty'):
+    # mode='pty': like pexpect.spawn, the command runs under a pseudo-terminal which merges stdout and stderr.
+    # mode='pipe': stdout and stderr are two block-buffered pipes, read separately.
+    # mode='spawn': the pipes of mode='pipe', but the command is started by os.posix_spawn, which glibc implements
+    # with a vfork-like clone: the pages of a large server are not copied nor even mapped for a child which execs.
+    # In all cases the output is read by chunks of up to 64 KiB through the event loop: waiting for output does not
+    # block the other commands.
+    argv = shlex.split(cmd)
+    if mode == 'spawn':
+        (out, outw), (err, errw) = os.pipe(), os.pipe()
+        # The descriptors of the parent are not inheritable (PEP 446): the child only gets the three below.
+        actions = [(os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0), (os.POSIX_SPAWN_DUP2, outw, 1), (os.POSIX_SPAWN_DUP2, errw, 2)]
+        try:
+            pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=actions)
+            try: proc = Spawned(pid)
+            except BaseException:
+                # The child can not be watched: it must not be left running nor unreaped.
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                raise
+        except BaseException:
+            for fd in (out, err): os.close(fd)
+            raise
+        finally:
+            for fd in (outw, errw): os.close(fd)
+        return proc, {'stdout': await connect(out), 'stderr': await connect(err)}
+    if mode == 'pipe':
+        proc = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20)
+        return proc, {'stdout': proc.stdout, 'stderr': proc.stderr}
+    master, slave = pty.openpty()
+    try: proc = await asyncio.create_subprocess_exec(*argv, stdin=slave, stdout=slave, stderr=slave, start_new_session=True)
+    except BaseException:
+        os.close(master)
+        raise
+    finally: os.close(slave)
+    return proc, {'stdout': await connect(master)}
+
+async def read(reader, size=1 << 16):
+    # Reads whatever is available, up to size bytes: the lines are split by batch, not one readline at a time.
+    try: return await reader.read(size)
+    except OSError as e:
+        # Reading the master side of a pseudo-terminal fails with EIO once the command has closed it.
+        if e.errno == errno.EIO: return b''
+        raise
+
+def splitblock(data, carry=b''):
+    # Splits data after its last newline: the block of complete lines is returned undecoded, the trailing partial line
+    # becomes the new carry. A newline byte never occurs inside a UTF-8 sequence, so no character is cut in two.
+    if carry: data = carry + data
+    end = data.rfind(b'\n') + 1
+    return data[:end], data[end:]
+
+async def pump(reader, stream, queue):
+    # Puts (stream, block, time of the read) items on queue, block being raw bytes made of complete lines, then
+    # (stream, None, None) when the stream is exhausted. Nothing is decoded here: the stores and the view decode
+    # what they display.
+    carry = b''
+    while data := await read(reader):
+        block, carry = splitblock(data, carry)
+        if block: await queue.put((stream, block, time.monotonic()))
+    if carry: await queue.put((stream, carry, time.monotonic()))
+    await queue.put((stream, None, None))
+
+async def readout(cmd, mode, onblock, timeout=None, ontimeout=None):
+    # Runs cmd to its end and calls onblock(block, stream, readat) for each block of its output, in the order of the
+    # reads. When timeout() returns a delay and nothing is read within it, ontimeout() is called. Returns the exit
+    # status of cmd. When the read is cancelled or a callback raises, the command is killed and reaped and its
+    # output is closed.
+    proc, readers = await spawn(cmd, mode)
+    queue = asyncio.Queue()
+    pumps = [asyncio.create_task(pump(reader, stream, queue)) for stream, reader in readers.items()]
+    try:
+        active = len(pumps)
+        while active:
+            try: stream, block, readat = await asyncio.wait_for(queue.get(), timeout() if timeout else None)
+            except asyncio.TimeoutError:
+                ontimeout()
+                continue
+            if block is None:
+                active -= 1
+                continue
+            onblock(block, stream, readat)
+        return await proc.wait()
+    finally:
+        for task in pumps: task.cancel()
+        # A StreamReader has no close of its own: its transport is closed, which releases the descriptor now.
+        for reader in readers.values():
+            if reader._transport: reader._transport.close()
+        if proc.returncode is None:
+            try: proc.kill()
+            except ProcessLookupError: pass
+            await proc.wait()
+
+def newloop(fast=False):
+    # With fast=True, a uvloop loop when uvloop is installed (its callbacks are cheaper with hundreds of commands),
+    # the default asyncio loop otherwise.
+    return uvloop.new_event_loop() if fast and uvloop else asyncio.new_event_loop()
+
+@st.cache_resource
+def eventloop(fast=False):
+    # A single event loop for the whole server, running forever in its own thread: coroutines are submitted to it
+    # with asyncio.run_coroutine_threadsafe, without creating and closing a loop for each run of the script.
+    loop = newloop(fast)
+    threading.Thread(target=loop.run_forever, daemon=True, name='eventloop').start()
+    return loop
+
+class Scheduler:
+    # Lets at most max_parallel commands run at the same time; the others wait for a slot, lowest priority first
+    # (in submission order for equal priorities).
+    def __init__(self, max_parallel=4):
+        self.max_parallel = max_parallel
+        self.running = 0
+        self.waiting = []
+        self.seq = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self.running < self.max_parallel and not self.waiting:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.seq), future))
+        try: await future
+        except asyncio.CancelledError:
+            # A slot handed over just before the cancellation must not be lost.
+            if future.done() and not future.cancelled(): self.release()
+            raise
+
+    def release(self):
+        while self.waiting:
+            future = heapq.heappop(self.waiting)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+def endlabel(endst, log, state):
+    label = f"{endst}: Complete" if state == 'complete' else f"{endst}: Ended with errors"
+    if log.dropped: label += f" ({log.dropped} lines dropped)"
+    return label
+
+async def launchandview(cmd, endst, height=300, key=None, mode='pty', store='ring', max_lines=10000, max_bytes=1 << 20, flush_interval=0.1, flush_bytes=64 << 10, scheduler=None, priority=0, metrics=None):
+    # store='ring' keeps the last lines in memory (within max_lines and max_bytes), store='spool' keeps all of them on disk.
+    # When metrics is a list, the lag metrics of the command are appended to it. With a key, the view can be paged
+    # with a Follow toggle and a first line input, and the log is kept in st.session_state[key] once the command is
+    # over: showlog(key) displays it again on the next runs, at the page chosen by the user.
+    log = openlog(store, max_lines=max_lines, max_bytes=max_bytes)
+    with st.status(f"{cmd} (queued)" if scheduler else cmd, expanded=not scheduler) as stx:
+        start = pager(key, LogView.rowsfor(height)) if key else None
+        if not scheduler: return await capture(cmd, endst, stx, log, height, start, key, mode, flush_interval, flush_bytes, metrics)
+        await scheduler.acquire(priority)
+        try:
+            stx.update(label=cmd, expanded=True)
+            return await capture(cmd, endst, stx, log, height, start, key, mode, flush_interval, flush_bytes, metrics)
+        finally: scheduler.release()
+
+async def capture(cmd, endst, stx, log, height, start, key, mode, flush_interval, flush_bytes, metrics):
+    view = LogView(log, height=height, start=start, flush_interval=flush_interval, flush_bytes=flush_bytes, showlag=True)
+    status = await readout(cmd, mode, view.write, view.timeout, view.flush)
+    view.flush()
+    if metrics is not None: metrics.append({'command': cmd, 'lines': log.end, **view.lag.metrics()})
+    state = 'complete' if status == 0 else 'error'
+    stx.update(label=endlabel(endst, log, state), state=state, expanded=False)
+    if key: st.session_state[key] = (endst, state, log)
+    return log
+
+def showlog(key, height=300):
+    # The log of the command launched by launchandview with this key, once it is over, at the page chosen by the user.
+    if key not in st.session_state: return
+    endst, state, log = st.session_state[key]
+    with st.status(endlabel(endst, log, state), state=state, expanded=True):
+        LogView(log, height=height, start=pager(key, LogView.rowsfor(height))).page()
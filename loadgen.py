@@ -0,0 +1,30 @@
+import argparse, random, sys, time
+
+# Deterministic load generator for the benchmarks: writes lines at a fixed rate (0 for as fast as possible), of a fixed
+# length, to stdout or stderr with a fixed ratio, possibly by bursts. Each line starts with the time it was written,
+# so that the reader can measure the latency of the capture.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--rate', type=float, default=1000, help='lines per second, 0 for unthrottled')
+    parser.add_argument('--length', type=int, default=80, help='length of the lines, newline included')
+    parser.add_argument('--stderr', type=float, default=0, help='ratio of the lines written to stderr')
+    parser.add_argument('--burst', type=int, default=1, help='lines written at once, the average rate is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--buffered', action='store_true', help='do not flush after each burst')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    start = time.time()
+    for first in range(0, args.lines, args.burst):
+        if args.rate:
+            delay = start + first / args.rate - time.time()
+            if delay > 0: time.sleep(delay)
+        for seq in range(first, min(first + args.burst, args.lines)):
+            out = sys.stderr if rng.random() < args.stderr else sys.stdout
+            out.write(f'{time.time():.6f} {seq:08d} '.ljust(args.length - 1, 'x') + '\n')
+        if not args.buffered:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+if __name__ == '__main__':
+    main()
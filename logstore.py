@@ -0,0 +1,149 @@
+import mmap, re, tempfile
+from array import array
+
+_lines = re.compile(rb'[^\n]*\n|[^\n]+')
+
+def decode(line):
+    return line.decode('utf8', 'replace') if isinstance(line, bytes) else line
+
+def size(line):
+    return len(line) if isinstance(line, bytes) else len(line.encode())
+
+class LineIndex:
+    # Compact index of the offsets where lines start, built incrementally: line i spans offsets[i]:offsets[i + 1].
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.size = 0
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, length):
+        self.size += length
+        self.offsets.append(self.size)
+
+    def addchunk(self, data):
+        # Indexes every line ended in data; a trailing partial line is indexed when its end arrives.
+        base = self.size
+        self.size += len(data)
+        pos = data.find(b'\n')
+        while pos >= 0:
+            self.offsets.append(base + pos + 1)
+            pos = data.find(b'\n', pos + 1)
+
+    def span(self, start, stop):
+        return self.offsets[start], self.offsets[stop]
+
+class RingLog:
+    # Bounded line store: once max_lines or max_bytes is exceeded the oldest lines are evicted and counted in dropped.
+    # Each line is kept with the name of the stream it comes from, in a circular list: line i is in slot i % max_lines,
+    # so any window of lines is reached directly. Lines written as raw bytes are only decoded when they are read.
+    def __init__(self, max_lines=10000, max_bytes=1 << 20):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.size = 0
+        self.dropped = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.dropped
+
+    @property
+    def first(self):
+        return self.dropped
+
+    def append(self, line, stream='stdout'):
+        if len(self) == self.max_lines: self.evict()
+        if self.end < self.max_lines: self.entries.append((stream, line))
+        else: self.entries[self.end % self.max_lines] = (stream, line)
+        self.end += 1
+        self.size += size(line)
+        while self.size > self.max_bytes: self.evict()
+
+    def evict(self):
+        slot = self.dropped % self.max_lines
+        self.size -= size(self.entries[slot][1])
+        self.entries[slot] = None
+        self.dropped += 1
+
+    def extend(self, lines, stream='stdout'):
+        for line in lines: self.append(line, stream)
+
+    def write(self, block, stream='stdout'):
+        # block is raw bytes made of complete lines (the last one may be partial at the end of the output).
+        self.extend(_lines.findall(block), stream)
+
+    def lines(self, start, stop):
+        # Lines are numbered from the start of the command, evicted ones included.
+        return [decode(self.entries[i % self.max_lines][1]) for i in range(max(start, self.first), min(stop, self.end))]
+
+    def tagged(self, start, stop):
+        # The (stream, line) entries of lines start to stop.
+        return [(stream, decode(line)) for stream, line in (self.entries[i % self.max_lines] for i in range(max(start, self.first), min(stop, self.end)))]
+
+    def close(self):
+        pass
+
+class SpoolLog:
+    # Unbounded line store kept on disk: lines are appended to a spool file and read back through mmap,
+    # using the offset of the start of each line, so the memory used does not depend on the volume of the output.
+    streams = ('stdout', 'stderr')
+
+    def __init__(self, dir=None):
+        self.file = tempfile.TemporaryFile(dir=dir)
+        self.index = LineIndex()
+        self.tags = bytearray()
+        self.map = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.tags)
+
+    @property
+    def first(self):
+        return 0
+
+    @property
+    def end(self):
+        return len(self.tags)
+
+    def append(self, line, stream='stdout'):
+        self.extend([line], stream)
+
+    def extend(self, lines, stream='stdout'):
+        data = [line.encode() for line in lines]
+        self.file.write(b''.join(data))
+        for chunk in data: self.index.add(len(chunk))
+        self.tags.extend(bytes([self.streams.index(stream)]) * len(data))
+
+    def write(self, block, stream='stdout'):
+        # block is raw bytes made of complete lines: it is written and indexed without being decoded.
+        count = len(self.index)
+        self.file.write(block)
+        self.index.addchunk(block)
+        if not block.endswith(b'\n'): self.index.add(0)
+        self.tags.extend(bytes([self.streams.index(stream)]) * (len(self.index) - count))
+
+    def lines(self, start, stop):
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop: return []
+        offsets = self.index.offsets
+        if self.map is None or len(self.map) < offsets[stop]:
+            # The file has grown beyond the mapped part: map it again.
+            self.file.flush()
+            if self.map is not None: self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return [self.map[offsets[i]:offsets[i + 1]].decode('utf8', 'replace') for i in range(start, stop)]
+
+    def tagged(self, start, stop):
+        start = max(start, 0)
+        return list(zip((self.streams[tag] for tag in self.tags[start:stop]), self.lines(start, stop)))
+
+    def close(self):
+        if self.map is not None: self.map.close()
+        self.file.close()
+
+def openlog(store='ring', max_lines=10000, max_bytes=1 << 20, dir=None):
+    if store == 'spool': return SpoolLog(dir=dir)
+    return RingLog(max_lines=max_lines, max_bytes=max_bytes)
@@ -0,0 +1,109 @@
+import time
+from collections import deque
+import streamlit as st
+from logstore import openlog
+
+def pager(key, rows):
+    # Follow toggle and first line input of a paged view: returns the first line of the page to display, None to
+    # follow the end of the log.
+    if st.toggle('Follow', value=True, key=f'{key}follow'): return None
+    return st.number_input('First line', min_value=0, value=0, step=rows, key=f'{key}start')
+
+class Lag:
+    # Delays between the read of the chunks of a command and their flush to the page, in seconds; the last size
+    # delays are kept for the quantiles.
+    def __init__(self, size=10000):
+        self.delays = deque(maxlen=size)
+        self.chunks = 0
+
+    def add(self, delay):
+        self.delays.append(delay)
+        self.chunks += 1
+
+    def quantile(self, q):
+        delays = sorted(self.delays)
+        return delays[min(len(delays) - 1, int(len(delays) * q))] if delays else 0
+
+    def metrics(self):
+        return {'chunks': self.chunks, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99), 'max': max(self.delays, default=0)}
+
+    def summary(self):
+        return f"Lag from read to display: p50 {self.quantile(0.5) * 1000:.1f} ms, p99 {self.quantile(0.99) * 1000:.1f} ms over {self.chunks} chunks"
+
+class LogView:
+    # Paged view over a log store: the lines written to the view are kept in its log, and only the page of lines
+    # that fits in the viewport is read back from the log, decoded and rendered in a single placeholder, so the cost
+    # of an update does not depend on the size of the log, neither on the server nor in the browser. With start None
+    # the view follows the end of the log, otherwise it shows the page beginning at line start (numbered from the
+    # start of the command). The page is rendered at most every flush_interval seconds or every flush_bytes bytes.
+    # Lines coming from stderr are prefixed so that both streams can be told apart. The delay between the read of each
+    # chunk, when its time is given, and its flush is recorded in lag; with showlag, its summary is displayed under the
+    # view and updated at each flush.
+    prefixes = {'stderr': '[stderr] '}
+    rowheight = 21
+
+    def __init__(self, log=None, height=300, language=None, start=None, flush_interval=0.1, flush_bytes=64 << 10, showlag=False):
+        self.log = openlog() if log is None else log
+        self.language = language
+        self.rows = self.rowsfor(height)
+        self.start = start
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.window = deque(maxlen=self.rows)
+        self.pending = []
+        self.pending_bytes = 0
+        self.flushed = 0
+        self.lag = Lag()
+        self.placeholder = st.container(height=height).empty()
+        self.caption = st.empty() if showlag else None
+
+    @classmethod
+    def rowsfor(cls, height):
+        return max(1, (height - 32) // cls.rowheight)
+
+    def append(self, line, stream='stdout', readat=None):
+        self.extend([line], stream, readat)
+
+    def extend(self, lines, stream='stdout', readat=None):
+        self.log.extend(lines, stream)
+        self.add(sum(map(len, lines)), readat)
+
+    def write(self, block, stream='stdout', readat=None):
+        # block is raw bytes made of complete lines: it is stored undecoded, only the lines of the page are decoded.
+        self.log.write(block, stream)
+        self.add(len(block), readat)
+
+    def add(self, size, readat):
+        self.pending.append(readat)
+        self.pending_bytes += size
+        if self.pending_bytes >= self.flush_bytes or time.monotonic() - self.flushed >= self.flush_interval: self.flush()
+
+    def timeout(self):
+        # Seconds left before the pending lines must be flushed, None when nothing is pending.
+        if not self.pending: return None
+        return max(0, self.flushed + self.flush_interval - time.monotonic())
+
+    def flush(self):
+        if self.pending:
+            now = time.monotonic()
+            for readat in self.pending:
+                if readat is not None: self.lag.add(now - readat)
+            self.page()
+            if self.caption: self.caption.caption(self.lag.summary())
+        self.pending = []
+        self.pending_bytes = 0
+        self.flushed = time.monotonic()
+
+    def page(self):
+        # Displays the page of the log chosen by start.
+        start = self.log.end - self.rows if self.start is None else self.start
+        self.show(self.log.tagged(start, start + self.rows))
+
+    def show(self, entries):
+        # Displays the given page of (stream, line) entries.
+        self.window.clear()
+        self.window.extend(self.prefixes.get(stream, '') + line for stream, line in entries[:self.rows])
+        self.render()
+
+    def render(self):
+        self.placeholder.code(''.join(self.window).replace('\r\n', '\n').rstrip('\n'), language=self.language)
@@ -1,12 +1,22 @@
 from pathlib import Path
 import streamlit as st
 import streamlit.components.v1 as components
-import tempfile, os, inspect
+import tempfile, os, inspect, hashlib
 import pexpect
-def showcodeandrun(bloc):
+@st.cache_resource(max_entries=64)
+def compiled(bloc):
+    # The blocks are compiled once per server: a rerun finds their code objects by the hash of their text.
+    return compile(bloc, "<string>", "exec")
+def showcodeandrun(bloc, lazy=True):
+    # Each block runs in its own namespace. A lazy block only runs while its "Run the example" section is expanded,
+    # so a rerun only costs the blocks the user is interacting with. Without a Streamlit runtime (the page imported
+    # as __mp_main__ by a process pool) there is no section and nothing runs.
     st.code(bloc)
-    compiled_code = compile(bloc, "<string>", "exec")
-    exec(compiled_code, globals())
+    compiled_code = compiled(bloc)
+    if lazy:
+        with st.expander('Run the example', key=f'run{hashlib.sha1(bloc.encode()).hexdigest()[:12]}', on_change='rerun') as section:
+            if getattr(section, 'open', False): exec(compiled_code, {'__name__': '__example__'})
+    else: exec(compiled_code, {'__name__': '__example__'})
     st.divider()
 st.header('Streamlit and how to manage the output of long-running commands.', divider='rainbow')
 st.markdown('Antoine de Saint-Exupéry, in his book "Wind, Sand and Stars" published in 1939, said: "Perfection is achieved, not when there is nothing more to add, but when there is nothing left to take away."')
@@ -47,20 +57,13 @@ My name is bob and this is message 18 sent to stdout
 st.markdown('For each iteration in the loop, the program sleeps for a random duration between 0 and 5 seconds, then randomly decides whether to send a message to stdout or stderr, or not to send any message at all. And it does this 20 times (in the example).')
 st.markdown('With the parameters passed to the function, the execution duration is variable but it can theoretically go up to 100 seconds (20 * 5).')
 st.markdown('We will now try to write a Streamlit program that contains a button to launch this program and attempts to display the log of the program in a Streamlit component. The most suitable Streamlit component for this type of requirement is "status".')
+st.markdown('Each example below only runs when its "Run the example" section is expanded, except the following one which installs the program used by all the others.')
+st.markdown('The program is installed once per server: the file is only written when its content changes, to a temporary file then renamed, so a command starting at the same time never reads a half-written script.')
 showcodeandrun("""
 import streamlit as st, pexpect
+from scripts import extprg, install
 
-externprogram=open('/tmp/extprg.py', 'w')
-externprogram.write('import time, random, sys\\n')
-externprogram.write('def f(id, loop, rand):\\n')
-externprogram.write('   for i in range(loop):\\n')
-externprogram.write('      time.sleep(rand*random.random())\\n')
-externprogram.write('      out = random.randint(0,2)\\n')
-externprogram.write("      if out == 0: print(f'My name is {id} and this is message {i} sent to stdout')\\n")
-externprogram.write("      if out == 1: print(f'My name is {id} and this is message {i} sent to stderr', file=sys.stderr)\\n")
-externprogram.write("f(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))\\n")
-externprogram.write("exit(random.randint(0,1))\\n")
-externprogram.close()    
+install('/tmp/extprg.py', extprg)
 
 prg = st.button('Start long program', type='primary')
 if prg:
@@ -70,7 +73,7 @@ if prg:
         child.close()
         if child.exitstatus == 0: stx.update(label="python3 /tmp/extprg.py: Complete'", state="complete", expanded=False)
         else: stx.update(label="python3 /tmp/extprg.py: Ended with errors'", state="error", expanded=False)
-""")
+""", lazy=False)
 st.markdown('Setting aside the ergonomic aspect, this initial program roughly does what we want: during the execution of the program, we can visualize what is going on with the stdout and stderr of the command, we see when the program is running and when it is finished.')
 st.markdown('The main ergonomic issue is the space taken up by the result.')
 st.markdown("Let's consider the following program:")
@@ -185,26 +188,25 @@ showcodeandrun("""
 import streamlit as st
 def f(queue, name):
     queue.put(f"Hello! I'm {name}")
+    queue.put(None)
 prg = st.button('Start program', type='primary', key='ggg')
 if prg:    
-    import multiprocessing, time
+    import multiprocessing
+    from workers import drain
     queue = multiprocessing.Queue()
     f(queue, 'Ma Dalton')
     p1 = multiprocessing.Process(target=f, args=(queue, 'Joe'))
     p1.start()
     p2 = multiprocessing.Process(target=f, args=(queue, 'Averell'))
     p2.start()
-    time.sleep(1)
-    queue.put('EOQ')
-    while True:
-        x = queue.get()
-        if x == 'EOQ': break
+    for x in drain(queue, 3, [p1, p2]):
         st.write(x)
         print(x)
     queue.close()
     p1.join()
     p2.join()
 """)
+st.markdown('Each producer puts a marker (None) on the queue when it has finished: the main process displays the messages as soon as they arrive and stops reading the queue as soon as the last marker is received. Waiting a fixed amount of time before posting an end marker would both lose the messages sent after this delay and make the fast producers wait for nothing.')
 st.markdown('Here the program works as expected! The solution is a little bit complex: a queue must created and the interaction with Streamlit must be achieved from the main process!')
 st.subheader('Asyncio')
 showcodeandrun("""
@@ -228,7 +230,7 @@ st.markdown('This last approach using the asyncio module is probably the best wa
 st.subheader('Conclusion', divider='rainbow')
 st.markdown('The solution to our problem is as follows:')
 showcodeandrun("""
-import streamlit as st
+import streamlit as st, asyncio
 async def launchandview(cmd, endst):
     import pexpect
     child = pexpect.spawn(cmd, encoding='utf8')
@@ -269,3 +271,134 @@ st.markdown('Using "asyncio" is probably the most suitable solution to solve thi
 st.markdown('As we mentioned at the beginning, "the problem is simple but the implementation is rather complex"!')
 st.markdown('There remains an issue with the technique used to display the log. On each line produced, the entire log content is re-displayed. This is suitable for programs producing a reasonable number of lines, but for programs producing thousands of lines, this is probably intolerable in terms of performance and memory usage!')
 st.markdown('A Streamlit component such as st.code should have an "append" or "extend" method to add information to the component without having to recreate it entirely. But this is a topic for another discussion.')
+
+st.subheader('An append-only log view', divider='rainbow')
+st.markdown('Streamlit does not offer such a method, but there is a better way than re-displaying the whole log: only a few lines are visible in the container at a given time. The log view is a page over the log of the command: the lines are stored in the log, and only the page of lines that fits in the viewport is read back from it, decoded and displayed. The cost of an update no longer depends on the size of the log already displayed, neither on the server nor in the browser, even for a log of millions of lines.')
+st.markdown('The page is updated in place, it is not emptied and recreated: in follow mode, it shows the newest lines, which solves the focus problem met earlier. To read an older part of the log, the follow mode is disabled and the number of the first line of the page is chosen. As with any widget, this triggers a rerun which abandons the commands launched by the script: their logs are kept in the session, and they can be paged through once the commands are over. The jobs of the next section can be paged through while they are running.')
+st.markdown('To keep the number of messages sent to the browser under control when a command is very talkative, the lines are not sent one by one: they are accumulated and flushed at most every 100 ms or every 64 KiB, whichever comes first, and a last time when the command ends.')
+st.markdown('Moreover, the output of the commands is read as raw bytes, by chunks, and it is kept undecoded: the lines are only decoded when they are displayed, that is to say only the few lines of the page.')
+st.markdown('To know how stale the view is, the time at which each chunk of output is read is recorded, and compared with the time at which it is flushed to the page: the median and the 99th percentile of this lag are displayed under each command and updated at each flush while it runs, and they can be exported.')
+st.markdown('The element is available in the "logview" module:')
+from logview import LogView
+st.code(inspect.getsource(LogView))
+st.markdown('The lines are also kept on the server side, but in a bounded ring buffer: the memory used by a command depends on the configured caps, not on the volume of its output. The oldest lines are evicted first and counted.')
+from logstore import RingLog
+st.code(inspect.getsource(RingLog))
+st.markdown('And "launchandview" becomes the following. Note that the version given in the conclusion is not really parallel: "for line in child" blocks the event loop until a line arrives, "await asyncio.sleep(0)" only gives control back between two lines, and a quiet command stalls all the others. Here the pseudo-terminal of the command is read through the event loop itself, so each command progresses independently and the total duration is the one of the slowest command.')
+from launcher import launchandview
+st.code(inspect.getsource(launchandview))
+st.markdown('Under a pseudo-terminal, as with pexpect, stdout and stderr are merged into a single stream. With the "pipe" capture mode, the two streams are read separately through block-buffered pipes, in large chunks, and each line keeps the name of its stream: the lines coming from stderr are marked in the log view. The "spawn" capture mode reads the same pipes, but starts the command with "os.posix_spawn" instead of a fork: on a server using gigabytes of memory, a fork has to copy the page tables of the whole server for a child which immediately runs another program.')
+showcodeandrun("""
+import streamlit as st, asyncio, json
+from launcher import launchandview, showlog
+
+with st.form("example3"):
+    Joe = st.checkbox("Joe")
+    William = st.checkbox("William")
+    Jack = st.checkbox("Jack")
+    Averell = st.checkbox("Averell")
+    mode = st.radio("Capture mode", ["pty", "pipe", "spawn"], horizontal=True)
+    prg = st.form_submit_button("Start long programs", type="primary")
+if prg:
+    for name in ["Joe", "Jack", "William", "Averell"]: st.session_state.pop(f"example3{name}", None)
+    loop = asyncio.new_event_loop()
+    tasks, metrics = [], []
+    if Joe: tasks.append(launchandview("python3 /tmp/extprg.py Joe 100 0", "python3 /tmp/extprg.py Joe", key="example3Joe", mode=mode, metrics=metrics))
+    if Jack: tasks.append(launchandview("python3 /tmp/extprg.py Jack 100 0", "python3 /tmp/extprg.py Jack", key="example3Jack", mode=mode, metrics=metrics))
+    if William: tasks.append(launchandview("python3 /tmp/extprg.py William 100 0", "python3 /tmp/extprg.py William", key="example3William", mode=mode, metrics=metrics))
+    if Averell: tasks.append(launchandview("python3 /tmp/extprg.py Averell 100 0", "python3 /tmp/extprg.py Averell", key="example3Averell", mode=mode, metrics=metrics))
+    loop.run_until_complete(asyncio.wait([loop.create_task(t) for t in tasks]))
+    loop.close()
+    st.dataframe(metrics)
+    st.download_button("Export the metrics", json.dumps(metrics), "metrics.json", "application/json")
+else:
+    for name in ["Joe", "Jack", "William", "Averell"]: showlog(f"example3{name}")
+""")
+
+st.subheader('Jobs that survive reruns', divider='rainbow')
+st.markdown('In all the previous examples, the commands are launched by the script itself. Any interaction with a widget triggers a rerun of the script, and the commands in progress are abandoned with their output. To avoid this, the commands can be owned by a registry shared by the whole server (thanks to "st.cache_resource"): the output of each command is read into its log by a coroutine running on a single event loop, created once for the whole server and running in its own thread. The script only submits the coroutines to this loop and returns immediately: there is no event loop to create and close at each click, and the page only attaches to the jobs by their id at each rerun.')
+st.markdown('When the whole log must be kept, it can be spooled to disk instead of being kept in a ring buffer: the lines are appended to a file, and the page reads back only the lines it displays through "mmap", thanks to the offsets of the beginning of each line. The memory used no longer depends on the volume of the output. The same offsets give direct access to any page of the log: in the following example, when the follow mode of a job is disabled, the number of the first line to display can be chosen.')
+showcodeandrun("""
+import streamlit as st
+from jobs import jobmanager, attach
+
+with st.form("example4"):
+    Joe = st.checkbox("Joe")
+    William = st.checkbox("William")
+    Jack = st.checkbox("Jack")
+    Averell = st.checkbox("Averell")
+    store = st.radio("Log storage", ["ring", "spool"], horizontal=True)
+    fast = st.toggle("uvloop event loop")
+    prg = st.form_submit_button("Start long programs", type="primary")
+if prg:
+    jobs = st.session_state.setdefault('jobs', [])
+    if Joe: jobs.append(jobmanager().submit("python3 /tmp/extprg.py Joe 10 2", "python3 /tmp/extprg.py Joe", store=store, fast=fast))
+    if Jack: jobs.append(jobmanager().submit("python3 /tmp/extprg.py Jack 10 2", "python3 /tmp/extprg.py Jack", store=store, fast=fast))
+    if William: jobs.append(jobmanager().submit("python3 /tmp/extprg.py William 10 2", "python3 /tmp/extprg.py William", store=store, fast=fast))
+    if Averell: jobs.append(jobmanager().submit("python3 /tmp/extprg.py Averell 10 2", "python3 /tmp/extprg.py Averell", store=store, fast=fast))
+
+def showjobs():
+    jobs = [jobmanager().get(id) for id in st.session_state.get('jobs', [])]
+    jobs = [job for job in jobs if job]
+    for job in jobs: attach(job)
+    if not any(job.state == 'running' for job in jobs) and st.session_state.pop('refreshing', False): st.rerun()
+running = any(job and job.state == 'running' for job in map(jobmanager().get, st.session_state.get('jobs', [])))
+st.session_state['refreshing'] = running
+st.fragment(showjobs, run_every=1 if running else None)()
+""")
+
+st.subheader('Many commands', divider='rainbow')
+st.markdown('Launching hundreds of commands at the same time is not a good idea: the host is saturated and every command becomes slow. A scheduler limits the number of commands running in parallel. The other commands are displayed as queued, and they are started as soon as a slot is free, in priority order: in the following example, the shortest commands first.')
+showcodeandrun("""
+import streamlit as st, asyncio
+from launcher import launchandview, Scheduler
+
+with st.form("example5"):
+    count = st.slider("Number of commands", 1, 50, 10)
+    parallel = st.slider("Maximum parallelism", 1, 10, 3)
+    prg = st.form_submit_button("Start long programs", type="primary")
+if prg:
+    loop = asyncio.new_event_loop()
+    scheduler = Scheduler(max_parallel=parallel)
+    tasks = []
+    for i in range(count):
+        loops = (i * 7) % 20 + 1
+        tasks.append(launchandview(f"python3 /tmp/extprg.py Dalton{i} {loops} 1", f"python3 /tmp/extprg.py Dalton{i}", scheduler=scheduler, priority=loops))
+    loop.run_until_complete(asyncio.wait([loop.create_task(t) for t in tasks]))
+    loop.close()
+""")
+
+st.subheader('A pool of processes', divider='rainbow')
+st.markdown('The "multiprocessing" approach seen earlier can also be turned into something reusable: a pool of worker processes, created once for the whole server, to which tasks are submitted. The tasks send their messages back in batches, so that the main process is not woken up for each message, and each task signals its own end: the main process displays the messages as they arrive and stops as soon as the last task is over, without any sleep.')
+st.markdown('For tasks producing a heavy output, each message sent through a "multiprocessing.Queue" still costs a serialization and a write in a pipe. With shared memory rings, each worker writes the output of its tasks in its own ring buffer in shared memory, which is read directly by the main process: only the end of the tasks goes through the queue.')
+st.markdown('Each command also pays for the start of a new Python interpreter and for its imports, tens of milliseconds which matter when thousands of short Python jobs are launched. With pre-warmed interpreters, the Python script is run by the task "script" in a child forked from the worker, which already has the interpreter and its modules loaded: a start only costs a fork.')
+showcodeandrun("""
+import streamlit as st
+from logview import LogView
+from workers import workerpool, command, script
+
+with st.form("example6"):
+    Joe = st.checkbox("Joe")
+    William = st.checkbox("William")
+    Jack = st.checkbox("Jack")
+    Averell = st.checkbox("Averell")
+    shm = st.toggle("Shared memory rings")
+    warm = st.toggle("Pre-warmed interpreters")
+    prg = st.form_submit_button("Start long programs", type="primary")
+if prg:
+    names = [name for name, checked in [("Joe", Joe), ("William", William), ("Jack", Jack), ("Averell", Averell)] if checked]
+    cmds = [f"python3 /tmp/extprg.py {name} 10 2" for name in names]
+    statuses, views = [], []
+    for cmd in cmds:
+        statuses.append(st.status(cmd, expanded=True))
+        with statuses[-1]: views.append(LogView())
+    for i, kind, payload in workerpool(ring=1 << 20 if shm else 0).stream([(script, ('/tmp/extprg.py', name, '10', '2')) if warm else (command, (cmd,)) for name, cmd in zip(names, cmds)]):
+        if kind == 'messages':
+            views[i].extend(payload)
+            views[i].flush()
+        elif kind == 'output':
+            views[i].write(payload)
+            views[i].flush()
+        elif kind == 'done' and payload == 0: statuses[i].update(label=f"{cmds[i]}: Complete", state="complete", expanded=False)
+        else: statuses[i].update(label=f"{cmds[i]}: Ended with errors", state="error", expanded=False)
+""")
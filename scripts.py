@@ -0,0 +1,38 @@
+import hashlib, os, tempfile
+import streamlit as st
+
+# The program run by the examples and the benchmarks: it sleeps at random, writes at random to stdout or stderr and
+# ends with a random exit status. Usage: extprg.py name iterations max_sleep
+extprg = """import time, random, sys
+def f(id, loop, rand):
+   for i in range(loop):
+      time.sleep(rand*random.random())
+      out = random.randint(0,2)
+      if out == 0: print(f'My name is {id} and this is message {i} sent to stdout')
+      if out == 1: print(f'My name is {id} and this is message {i} sent to stderr', file=sys.stderr)
+f(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+exit(random.randint(0,1))
+"""
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+@st.cache_resource(validate=os.path.exists, show_spinner=False)
+def install(path, source):
+    # Makes path contain source, once per server and content: a rerun does not touch the file. The file is only
+    # written when its content differs, to a temporary file of the same directory renamed over path, so a command
+    # started meanwhile, from this server or another one, reads the old or the new script and never a partial one.
+    data = source.encode()
+    try:
+        with open(path, 'rb') as f:
+            if digest(f.read()) == digest(data): return path
+    except FileNotFoundError: pass
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f: f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
@@ -0,0 +1,15 @@
+from jobs import Job, JobManager
+from logstore import openlog
+
+def test_pruned_jobs_are_closed_and_show_nothing():
+    manager = JobManager(keep=1)
+    jobs = [Job(id, 'cmd', None, openlog('spool')) for id in (1, 2)]
+    for job in jobs:
+        job.log.write(b'a\nb\n')
+        job.state = 'complete'
+        manager.jobs[job.id] = job
+    manager.prune()
+    assert manager.get(1) is None and manager.get(2) is jobs[1]
+    assert jobs[0].window(None, 5) == []
+    assert jobs[1].window(None, 5) == [('stdout', 'a\n'), ('stdout', 'b\n')]
+    jobs[1].close()
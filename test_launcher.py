@@ -0,0 +1,55 @@
+import asyncio, os
+import pytest
+from launcher import Scheduler, readout, spawn
+
+def test_scheduler_limits_parallelism_and_follows_priorities():
+    async def run():
+        scheduler, running, peak, order = Scheduler(max_parallel=2), 0, 0, []
+        async def job(name, priority):
+            nonlocal running, peak
+            await scheduler.acquire(priority)
+            running += 1
+            peak = max(peak, running)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            running -= 1
+            scheduler.release()
+        await asyncio.gather(*(job(name, priority) for name, priority in [('a', 5), ('b', 5), ('c', 3), ('d', 1), ('e', 1)]))
+        return peak, order
+    assert asyncio.run(run()) == (2, ['a', 'b', 'd', 'e', 'c'])
+
+def test_scheduler_does_not_lose_a_slot_on_cancellation():
+    async def run():
+        scheduler = Scheduler(max_parallel=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        return scheduler.running
+    assert asyncio.run(run()) == 1
+
+def test_spawn_failures_leak_no_descriptor():
+    async def run():
+        for mode in ('pty', 'pipe', 'spawn'):
+            with pytest.raises(FileNotFoundError): await spawn('/nonexistent/command', mode)
+    before = len(os.listdir('/proc/self/fd'))
+    for i in range(5): asyncio.run(run())
+    assert len(os.listdir('/proc/self/fd')) == before
+
+@pytest.mark.parametrize('mode', ['pty', 'pipe', 'spawn'])
+def test_readout_kills_and_reaps_on_cancellation_and_errors(mode):
+    cmd = 'python3 -c "import time; print(1, flush=True); time.sleep(30)"'
+    def fail(block, stream, readat): raise ValueError(block)
+    async def run():
+        task = asyncio.create_task(readout(cmd, mode, lambda *block: None))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError): await task
+        with pytest.raises(ValueError): await asyncio.wait_for(readout(cmd, mode, fail), 5)
+    before = len(os.listdir('/proc/self/fd'))
+    asyncio.run(run())
+    assert len(os.listdir('/proc/self/fd')) == before
+    with pytest.raises(ChildProcessError): os.waitpid(-1, os.WNOHANG)
@@ -0,0 +1,34 @@
+from logstore import LineIndex, RingLog, SpoolLog
+
+def test_lineindex_spans_lines_across_chunks():
+    index = LineIndex()
+    index.addchunk(b'a\nbb\nccc')
+    assert len(index) == 2
+    index.addchunk(b'c\n')
+    index.add(2)
+    assert len(index) == 4
+    assert [index.span(i, i + 1) for i in range(4)] == [(0, 2), (2, 5), (5, 10), (10, 12)]
+
+def test_ringlog_evicts_the_oldest_lines():
+    log = RingLog(max_lines=3)
+    log.write(b'0\n1\n2\n3\n4\n')
+    assert (log.first, log.end, log.dropped) == (2, 5, 2)
+    assert log.lines(0, 5) == ['2\n', '3\n', '4\n']
+    assert log.lines(3, 4) == ['3\n']
+
+def test_ringlog_bounds_its_bytes():
+    log = RingLog(max_lines=100, max_bytes=10)
+    log.extend(['abcd\n'] * 5, 'stderr')
+    assert len(log) == 2
+    assert log.lines(log.first, log.end) == ['abcd\n', 'abcd\n']
+
+def test_spoollog_reads_back_lines_written_as_blocks():
+    log = SpoolLog()
+    try:
+        log.write(b'a\nb\n', 'stdout')
+        log.append('c\n', 'stderr')
+        assert log.lines(0, 3) == ['a\n', 'b\n', 'c\n']
+        log.write(b'd\ne', 'stdout')
+        assert log.lines(2, 10) == ['c\n', 'd\n', 'e']
+        assert list(log.tags) == [0, 0, 1, 0, 0]
+    finally: log.close()
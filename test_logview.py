@@ -0,0 +1,24 @@
+from logstore import openlog
+from logview import LogView
+
+def test_logview_pages_over_its_log():
+    log = openlog()
+    view = LogView(log, height=32 + 3 * LogView.rowheight)
+    for i in range(10): view.write(f'{i}\n'.encode(), 'stderr' if i == 8 else 'stdout')
+    view.flush()
+    assert log.end == 10
+    assert list(view.window) == ['7\n', '[stderr] 8\n', '9\n']
+    first = LogView(log, height=32 + 3 * LogView.rowheight, start=2)
+    first.append('10\n', readat=0)
+    first.flush()
+    assert list(first.window) == ['2\n', '3\n', '4\n']
+    assert first.lag.chunks == 1
+
+def test_logview_shows_its_lag_at_each_flush():
+    view = LogView(openlog(), showlag=True)
+    captions = []
+    view.caption.caption = captions.append
+    for i in range(2):
+        view.append(f'{i}\n', readat=0)
+        view.flush()
+    assert [text.endswith(f'over {i + 1} chunks') for i, text in enumerate(captions)] == [True, True]
@@ -0,0 +1,89 @@
+import queue, time
+import pytest
+from workers import Pool, ShmRing, drain, script
+
+def tagged(emit, task, count):
+    for i in range(count): emit(f'{task} {i}\n')
+    return task
+
+def quiet(emit):
+    emit('first\n')
+    time.sleep(0.01)
+    emit('second\n')
+    time.sleep(1)
+    return 0
+
+def outputs(pool, calls):
+    # The lines received by each call, and the results of the calls.
+    lines, results = {}, {}
+    for i, kind, payload in pool.stream(calls):
+        if kind == 'output': lines.setdefault(i, []).extend(payload.decode().splitlines())
+        elif kind == 'messages': lines.setdefault(i, []).extend(line.rstrip('\n') for line in payload)
+        else: results[i] = (kind, payload)
+    return lines, results
+
+def test_shmring_wraps_around():
+    ring = ShmRing(64)
+    try:
+        data = b''
+        for i in range(50):
+            chunk = bytes([i]) * 40
+            ring.write(chunk)
+            data += ring.read()
+        assert data == b''.join(bytes([i]) * 40 for i in range(50))
+        assert ring.read() == b''
+    finally: ring.close(unlink=True)
+
+@pytest.mark.parametrize('ring', [0, 1 << 20, 4096])
+def test_back_to_back_tasks_keep_their_output(ring):
+    # A single worker runs the tasks one after the other: the output of a task must never be credited to the next.
+    pool = Pool(processes=1, ring=ring)
+    try:
+        lines, results = outputs(pool, [(tagged, (task, 200)) for task in range(50)])
+        for task in range(50):
+            assert lines[task] == [f'{task} {i}' for i in range(200)]
+            assert results[task] == ('done', task)
+    finally: pool.close()
+
+def test_batches_are_sent_when_the_task_goes_quiet():
+    pool = Pool(processes=1)
+    try:
+        outputs(pool, [(tagged, (0, 1))])
+        start, arrivals = time.monotonic(), []
+        for i, kind, payload in pool.stream([(quiet, ())]): arrivals.append((kind, payload, time.monotonic() - start))
+        assert arrivals[0][:2] == ('messages', ['first\n', 'second\n']) and arrivals[0][2] < 0.5
+        assert arrivals[1][:2] == ('done', 0) and arrivals[1][2] >= 1
+    finally: pool.close()
+
+def test_script_exits_like_the_interpreter(tmp_path):
+    path = tmp_path / 'exits.py'
+    path.write_text("""import atexit, sys, threading, time
+atexit.register(print, 'at exit')
+def later():
+    time.sleep(0.1)
+    print('from thread', sys.argv[1:])
+threading.Thread(target=later).start()
+print('main done')
+sys.exit(3)
+""")
+    lines = []
+    assert script(lines.append, str(path), 'a', 'b') == 3
+    assert lines == ['main done\n', "from thread ['a', 'b']\n", 'at exit\n']
+
+class Replay:
+    # A queue whose first get times out, as when the producer puts its last messages and exits right after.
+    def __init__(self, items):
+        self.items = [queue.Empty] + items
+
+    def get(self, timeout=None):
+        item = self.items.pop(0)
+        if item is queue.Empty: raise queue.Empty
+        return item
+
+class Exited:
+    def is_alive(self):
+        return False
+
+def test_drain_reads_what_exited_producers_left():
+    assert list(drain(Replay(['a', 'b', None]), 1, [Exited()])) == ['a', 'b']
+    assert list(drain(Replay([queue.Empty]), 1, [Exited()])) == []
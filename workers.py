@@ -0,0 +1,278 @@
+import atexit, importlib, itertools, multiprocessing, os, queue, runpy, shlex, struct, subprocess, sys, threading, time, traceback
+from multiprocessing import shared_memory
+import streamlit as st
+from launcher import splitblock
+
+class Emitter:
+    # Given to the tasks to send messages back to the parent: the messages are batched, one queue put per batch
+    # of batch messages, so that the parent is not woken up for each message. A batch is also sent interval seconds
+    # after its first message, by a thread of the emitter, even when the task emits nothing more meanwhile.
+    def __init__(self, results, taskid, batch=64, interval=0.05):
+        self.results = results
+        self.taskid = taskid
+        self.batch = batch
+        self.interval = interval
+        self.items = []
+        self.due = None
+        self.closed = False
+        self.cond = threading.Condition()
+        self.timer = None
+
+    def __call__(self, message):
+        with self.cond:
+            self.items.append(('message', message))
+            if len(self.items) >= self.batch: self.send()
+            elif len(self.items) == 1:
+                self.due = time.monotonic() + self.interval
+                if not self.timer:
+                    self.timer = threading.Thread(target=self.run, daemon=True)
+                    self.timer.start()
+                self.cond.notify()
+
+    def run(self):
+        with self.cond:
+            while not self.closed:
+                timeout = self.due - time.monotonic() if self.items else None
+                if timeout is not None and timeout <= 0: self.send()
+                else: self.cond.wait(timeout)
+
+    def send(self):
+        if self.items: self.results.put((self.taskid, self.items))
+        self.items = []
+
+    def flush(self, kind=None, payload=None):
+        # The end of the task: its last batch is sent with the (kind, payload) item.
+        with self.cond:
+            if kind: self.items.append((kind, payload))
+            self.send()
+            self.closed = True
+            self.cond.notify()
+        if self.timer: self.timer.join()
+
+class ShmRing:
+    # Single-producer/single-consumer byte ring in shared memory: the first 16 bytes hold the total number of bytes
+    # written and read, the data follows. The worker writes its output there and the main process reads it directly,
+    # without pickling nor a pipe write per message.
+    header = 16
+
+    def __init__(self, capacity=1 << 20, name=None):
+        if name: self.shm = shared_memory.SharedMemory(name=name)
+        else:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.header + capacity)
+            struct.pack_into('QQ', self.shm.buf, 0, 0, 0)
+        self.name = self.shm.name
+        self.capacity = self.shm.size - self.header
+
+    def write(self, data):
+        buf, capacity = self.shm.buf, self.capacity
+        while data:
+            written, read = struct.unpack_from('QQ', buf, 0)
+            free = capacity - (written - read)
+            if not free:
+                time.sleep(0.001)
+                continue
+            size = min(free, len(data))
+            pos = written % capacity
+            first = min(size, capacity - pos)
+            buf[self.header + pos:self.header + pos + first] = data[:first]
+            buf[self.header:self.header + size - first] = data[first:size]
+            struct.pack_into('Q', buf, 0, written + size)
+            data = data[size:]
+
+    def read(self):
+        buf, capacity = self.shm.buf, self.capacity
+        written, read = struct.unpack_from('QQ', buf, 0)
+        size = written - read
+        if not size: return b''
+        pos = read % capacity
+        first = min(size, capacity - pos)
+        data = bytes(buf[self.header + pos:self.header + pos + first]) + bytes(buf[self.header:self.header + size - first])
+        struct.pack_into('Q', buf, 8, written)
+        return data
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink: self.shm.unlink()
+
+class RingEmitter:
+    # Emitter writing the messages (str or bytes) of a task to the shared memory ring of its worker, each one framed
+    # with the id of the task and its length: the ring can hold the end of a task and the start of the next one. Only
+    # the end of the task goes through the results queue.
+    frame = struct.Struct('<QI')
+
+    def __init__(self, results, taskid, ring):
+        self.results = results
+        self.taskid = taskid
+        self.ring = ring
+
+    def __call__(self, message):
+        data = message.encode() if isinstance(message, str) else message
+        self.ring.write(self.frame.pack(self.taskid, len(data)) + data)
+
+    def flush(self, kind=None, payload=None):
+        if kind: self.results.put((self.taskid, [(kind, payload)]))
+
+def work(tasks, results, batch, interval, ring, preload):
+    # The modules in preload are imported once by each worker, before its first task.
+    for name in preload: importlib.import_module(name)
+    if ring: ring = ShmRing(name=ring)
+    while (task := tasks.get()) is not None:
+        taskid, fn, args = task
+        emit = RingEmitter(results, taskid, ring) if ring else Emitter(results, taskid, batch, interval)
+        try: result = fn(emit, *args)
+        except Exception as e: emit.flush('error', repr(e))
+        else: emit.flush('done', result)
+    if ring: ring.close()
+    # Each worker acknowledges the end of the pool with its own sentinel: no sleep is needed to know it is over.
+    results.put((None, os.getpid()))
+
+class Pool:
+    # A reusable pool of worker processes whose tasks stream messages back to the parent. A task is a picklable
+    # function called as fn(emit, *args); the results of the workers are dispatched by a thread of the parent to the
+    # inbox of the caller, where they are read by the thread that renders them. With ring set to a size in bytes,
+    # each worker writes the messages of its tasks to its own shared memory ring, polled by the dispatcher every
+    # interval seconds, and they are delivered as 'output' blocks of complete lines.
+    def __init__(self, processes=None, batch=64, interval=0.05, context='forkserver', ring=0, preload=()):
+        ctx = multiprocessing.get_context(context)
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.interval = interval
+        self.ids = itertools.count()
+        self.inboxes = {}
+        count = processes or os.cpu_count()
+        self.rings = [ShmRing(ring) for _ in range(count)] if ring else []
+        self.processes = [ctx.Process(target=work, args=(self.tasks, self.results, batch, interval, self.rings[i].name if ring else None, preload), daemon=True) for i in range(count)]
+        for process in self.processes: process.start()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True, name='pool')
+        self.dispatcher.start()
+
+    def dispatch(self):
+        running = len(self.processes)
+        partials, carries = [b''] * len(self.rings), {}
+        while running:
+            try: taskid, items = self.results.get(timeout=self.interval if self.rings else None)
+            except queue.Empty: taskid, items = None, []
+            if taskid is None and items:
+                running -= 1
+                continue
+            # The output of a task is entirely in its ring before its end is put on the queue: the rings are read
+            # before the end is delivered.
+            for index, ring in enumerate(self.rings): partials[index] = self.route(partials[index] + ring.read(), carries)
+            if items and items[-1][0] != 'message' and (carry := carries.pop(taskid, b'')): self.inboxes[taskid].put((taskid, [('output', carry)]))
+            if items: (self.inboxes[taskid] if items[-1][0] == 'message' else self.inboxes.pop(taskid)).put((taskid, items))
+
+    def route(self, data, carries):
+        # Delivers the complete lines of the whole frames of data to the inboxes of their tasks; returns the
+        # trailing partial frame.
+        frame, pos, blocks = RingEmitter.frame, 0, {}
+        while len(data) - pos >= frame.size:
+            taskid, size = frame.unpack_from(data, pos)
+            if len(data) - pos - frame.size < size: break
+            pos += frame.size
+            blocks.setdefault(taskid, []).append(data[pos:pos + size])
+            pos += size
+        for taskid, parts in blocks.items():
+            block, carries[taskid] = splitblock(b''.join(parts), carries.get(taskid, b''))
+            if block: self.inboxes[taskid].put((taskid, [('output', block)]))
+        return data[pos:]
+
+    def submit(self, fn, *args, inbox):
+        taskid = next(self.ids)
+        self.inboxes[taskid] = inbox
+        self.tasks.put((taskid, fn, args))
+        return taskid
+
+    def stream(self, calls):
+        # calls is a list of (fn, args); yields (index of the call, kind, payload) as the batches arrive: kind is
+        # 'messages' with the list of messages of a batch ('output' with raw bytes when the pool uses rings), then
+        # 'done' with the result of the call, or 'error'.
+        inbox = queue.SimpleQueue()
+        indexes = {self.submit(fn, *args, inbox=inbox): i for i, (fn, args) in enumerate(calls)}
+        pending = len(indexes)
+        while pending:
+            taskid, items = inbox.get()
+            if messages := [payload for kind, payload in items if kind == 'message']: yield indexes[taskid], 'messages', messages
+            for kind, payload in items:
+                if kind == 'message': continue
+                yield indexes[taskid], kind, payload
+                if kind != 'output': pending -= 1
+
+    def close(self):
+        for process in self.processes: self.tasks.put(None)
+        self.dispatcher.join()
+        for process in self.processes: process.join()
+        for ring in self.rings: ring.close(unlink=True)
+
+def command(emit, cmd):
+    # A task running cmd and emitting its output line by line; its result is the exit status of cmd.
+    proc = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in proc.stdout: emit(line.decode('utf8', 'replace'))
+    return proc.wait()
+
+def runscript(path, args, out):
+    # Runs in the forked child: the script gets the redirected standard streams, its own argv and sys.path[0], and
+    # runs as __main__, then the interpreter exit is done as by python3: the non-daemon threads of the script are
+    # joined and its atexit handlers run, not the ones inherited from the worker. Returns its exit status.
+    atexit._clear()
+    null = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null, 0)
+    os.close(null)
+    for fd in (1, 2): os.dup2(out, fd)
+    os.close(out)
+    # Fresh streams on the redirected descriptors, buffered as they are by a new interpreter writing to a pipe.
+    sys.stdin, sys.stdout, sys.stderr = open(0, closefd=False), open(1, 'w', closefd=False), open(2, 'w', buffering=1, closefd=False)
+    sys.argv = [path, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    code = 0
+    try: runpy.run_path(path, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int): code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    threading._shutdown()
+    atexit._run_exitfuncs()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+def script(emit, path, *args):
+    # A task running the Python script path with args as "python3 path args" would, but in a child forked from the
+    # worker: the interpreter and the modules of the worker are already loaded, so a start costs a fork instead of
+    # an interpreter start and the imports. The output is emitted line by line, stderr merged into stdout; the result
+    # is the exit status of the script.
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        # The child must never return into the worker loop, whatever happens.
+        code = 1
+        try:
+            os.close(r)
+            code = runscript(path, args, w)
+        finally: os._exit(code)
+    os.close(w)
+    with open(r, 'rb') as out:
+        for line in out: emit(line.decode('utf8', 'replace'))
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def drain(messages, producers, processes=()):
+    # Yields the messages put on the multiprocessing queue messages until each of the producers has put its done
+    # marker (None): nothing is lost and nothing waits once the last producer is over. If processes are given, the
+    # drain also ends when they have all exited without their marker (a producer that crashed).
+    while producers:
+        try: message = messages.get(timeout=0.1 if processes else None)
+        except queue.Empty:
+            if any(process.is_alive() for process in processes): continue
+            # A producer may have put its last messages just before exiting: they are read before giving up.
+            try: message = messages.get(timeout=0.1)
+            except queue.Empty: return
+        if message is None: producers -= 1
+        else: yield message
+
+@st.cache_resource
+def workerpool(ring=0, preload=()):
+    # The demo tasks mostly wait for commands: more workers than cores is fine.
+    return Pool(processes=max(4, os.cpu_count()), ring=ring, preload=preload)